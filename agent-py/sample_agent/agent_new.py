@@ -2,18 +2,13 @@
 DevRel publishing agent that generates content from GitHub repo changes.
 """
 
+import asyncio
+import copy
 import json
-import os
-import re
-import uuid
-from datetime import datetime
-from typing import List, Dict, Optional, TypedDict, Any
-from typing_extensions import Literal
 
-import psycopg2
-import requests
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from litellm import completion
+from pydantic import Field
 from crewai.flow.flow import Flow, start, router, listen
 import logging
 
@@ -25,6 +20,34 @@ from copilotkit.crewai import (
     CopilotKitState
 )
 
+from sample_agent.github import (
+    extract_repo_info,
+    github_api_paginate,
+    fetch_recent_pull_requests,
+    fetch_repository_data,
+    fetch_pull_request_files,
+    project_issue,
+    issue_details,
+    is_doc_file,
+    parse_issue_number
+)
+from sample_agent.llm import (
+    TOPIC_MODEL,
+    CONTENT_MODEL,
+    cacheable_message,
+    system_message,
+    cacheable_tools,
+    compact_context,
+    dumps,
+    has_tool_call,
+    extract_json_object,
+    loads,
+    loads_tolerant
+)
+from sample_agent.llm_cache import LLMResponseCache
+
+from sample_agent.db import content_writer, driver_available
+
 # Load environment variables
 load_dotenv()
 
@@ -124,32 +147,28 @@ WRITE_CONTENT_TOOL = {
     }
 }
 
-# GitHub API helpers
-def extract_repo_info(repo_url: str) -> tuple:
-    """Extract owner and repo name from GitHub URL."""
-    pattern = r"github\.com/([^/]+)/([^/]+)"
-    match = re.search(pattern, repo_url)
-    if match:
-        owner, repo = match.groups()
-        return owner, repo
-    raise ValueError(f"Invalid GitHub URL: {repo_url}")
+# Serves repeated topic and draft requests without another LLM round-trip
+response_cache = LLMResponseCache()
 
-def github_api_request(endpoint: str, params: Dict = None) -> Dict:
-    """Make a request to GitHub API with proper auth and error handling."""
-    github_token = os.getenv("GITHUB_TOKEN")
-    headers = {
-        "Accept": "application/vnd.github.v3+json",
-    }
-    if github_token:
-        headers["Authorization"] = f"token {github_token}"
-    
-    base_url = "https://api.github.com"
-    response = requests.get(f"{base_url}/{endpoint}", headers=headers, params=params)
-    
-    if response.status_code != 200:
-        raise Exception(f"GitHub API error: {response.status_code} - {response.text}")
-    
-    return response.json()
+# Analysis results by (repo_url, start_date), so a repository resubmitted
+# within a few minutes skips the GitHub round-trips
+ANALYSIS_CACHE_TTL = 300
+analysis_cache = TTLCache(maxsize=256, ttl=ANALYSIS_CACHE_TTL)
+
+async def emit_progress(stage: str, count: int, status: str):
+    """
+    Report a progress step with only the keys the progress view renders.
+
+    The UI treats each emit as a snapshot, so the step count always travels
+    with the status line it belongs to.
+    """
+    await copilotkit_emit_state({"progress": {"stage": stage, "count": count}, "status": status})
+
+async def stream_completion(**kwargs):
+    """Stream a completion to the frontend and return the assistant message."""
+    from litellm import completion
+    response = await copilotkit_stream(completion(**kwargs, stream=True))
+    return response.choices[0].message
 
 class DevRelAgentState(CopilotKitState):
     """
@@ -161,29 +180,29 @@ class DevRelAgentState(CopilotKitState):
     start_date: str = ""
     
     # Analysis Data
-    issues: List[Dict] = []
-    pull_requests: List[Dict] = []
-    docs_changes: List[Dict] = []
+    issues: list[dict] = Field(default_factory=list)
+    pull_requests: list[dict] = Field(default_factory=list)
+    docs_changes: list[dict] = Field(default_factory=list)
     
     # Generated Topics
-    topics: List[Dict] = []
-    selected_topic: Dict = {}
+    topics: list[dict] = Field(default_factory=list)
+    selected_topic: dict = Field(default_factory=dict)
     
     # Content Generation
-    content_drafts: Dict[str, str] = {
+    content_drafts: dict[str, str] = Field(default_factory=lambda: {
         "blog_post": "",
         "code_example": "",
         "social_media": ""
-    }
+    })
     
     # Database Record
-    content_record: Dict[str, str] = {
+    content_record: dict[str, str] = Field(default_factory=lambda: {
         "channel": "",
         "title": "",
         "summary": "",
         "content": "",
         "type": ""
-    }
+    })
     
     # Status and errors
     status: str = ""
@@ -216,55 +235,84 @@ class DevRelPublisherFlow(Flow[DevRelAgentState]):
     @router(select_date_range)
     async def analyze_repository(self):
         logger.info("Entered analyze_repository")
+        self._db_task = None
         try:
-            owner, repo = extract_repo_info(self.state.repo_url)
-            await copilotkit_emit_state({"status": "Fetching pull requests..."})
-            # Fetch pull requests only
-            prs_endpoint = f"repos/{owner}/{repo}/pulls"
-            prs_params = {"state": "all", "sort": "created", "direction": "desc"}
-            all_prs = github_api_request(prs_endpoint, prs_params)
-            self.state.pull_requests = [
-                {
-                    "number": pr["number"],
-                    "title": pr["title"],
-                    "body": pr.get("body", ""),
-                    "created_at": pr["created_at"],
-                    "user": pr["user"]["login"]
-                }
-                for pr in all_prs
-                if datetime.strptime(pr["created_at"], "%Y-%m-%dT%H:%M:%SZ") >= datetime.strptime(self.state.start_date, "%Y-%m-%d")
-            ]
-            await copilotkit_emit_state({
-                "status": f"Found {len(self.state.pull_requests)} pull requests after {self.state.start_date}"
-            })
+            analysis_key = (self.state.repo_url, self.state.start_date)
+            cached = analysis_cache.get(analysis_key)
+            if cached is not None:
+                # Later steps mutate the state, so each run gets its own copy
+                (
+                    self.state.pull_requests, self.state.issues, self.state.docs_changes,
+                    self._prs_by_number, self._issues_by_number, self._repo_context
+                ) = copy.deepcopy(cached)
+                await copilotkit_emit_state({"status": "Using recently fetched repository data"})
+                return "generate_topics"
 
-            # Fetch issues
+            owner, repo = extract_repo_info(self.state.repo_url)
+            await copilotkit_emit_state({"status": "Fetching pull requests and issues..."})
+            # The issue list is independent of the pull requests, so it loads
+            # while the pull requests and then their file lists are fetched
+            start_iso = f"{self.state.start_date}T00:00:00Z"
             issues_endpoint = f"repos/{owner}/{repo}/issues"
-            issues_params = {"state": "all", "since": f"{self.state.start_date}T00:00:00Z"}
-            self.state.issues = github_api_request(issues_endpoint, issues_params)
-            await copilotkit_emit_state({
-                "status": f"Found {len(self.state.issues)} issues"
-            })
+            issues_params = {"state": "all", "since": start_iso}
+            issues_task = asyncio.create_task(github_api_paginate(issues_endpoint, issues_params))
+            try:
+                recent_prs = await fetch_recent_pull_requests(owner, repo, start_iso)
+                # Fetch documentation changes (from PRs), batching the file lists
+                # into GraphQL queries
+                all_pr_files, all_issues = await asyncio.gather(
+                    fetch_pull_request_files(owner, repo, [pr["number"] for pr in recent_prs]),
+                    issues_task
+                )
+            except BaseException:
+                # Stop the issue fetch and collect its outcome so a failure
+                # there is not reported as never retrieved
+                issues_task.cancel()
+                await asyncio.gather(issues_task, return_exceptions=True)
+                raise
+            # Keep only the fields the prompts use; bodies are kept aside for
+            # drafting about a single source
+            self.state.pull_requests = [project_issue(pr) for pr in recent_prs]
+            self.state.issues = [project_issue(i) for i in all_issues]
+            self._prs_by_number = {pr["number"]: issue_details(pr) for pr in recent_prs}
+            self._issues_by_number = {i["number"]: issue_details(i) for i in all_issues}
+            await emit_progress(
+                "pull_requests",
+                len(self.state.pull_requests),
+                f"Found {len(self.state.pull_requests)} pull requests after {self.state.start_date}"
+            )
+            await emit_progress("issues", len(self.state.issues), f"Found {len(self.state.issues)} issues")
 
-            # Fetch documentation changes (from PRs)
             docs_changes = []
-            for pr in self.state.pull_requests:
-                # For each PR, fetch the files changed
-                pr_files_endpoint = f"repos/{owner}/{repo}/pulls/{pr['number']}/files"
-                pr_files = github_api_request(pr_files_endpoint)
-                doc_files = [f for f in pr_files if f["filename"].endswith(("CHANGELOG"))]
+            for pr, pr_files in zip(self.state.pull_requests, all_pr_files):
+                doc_files = [{"filename": path} for path in pr_files if is_doc_file(path)]
                 if doc_files:
                     docs_changes.append({
                         "pr": pr,
                         "doc_files": doc_files
                     })
             self.state.docs_changes = docs_changes
-            await copilotkit_emit_state({
-                "status": f"Found {len(self.state.docs_changes)} documentation changes"
-            })
+            await emit_progress(
+                "docs_changes",
+                len(self.state.docs_changes),
+                f"Found {len(self.state.docs_changes)} documentation changes"
+            )
+
+            # Serialized once here so topic retries reuse it
+            self._repo_context = compact_context(
+                issues=self.state.issues,
+                pull_requests=self.state.pull_requests,
+                doc_changes=[{
+                    "files": [f["filename"] for f in d["doc_files"]]
+                } for d in self.state.docs_changes]
+            )
 
             # If we have data, proceed to generate topics
             if (self.state.pull_requests or self.state.issues or self.state.docs_changes):
+                analysis_cache[analysis_key] = copy.deepcopy((
+                    self.state.pull_requests, self.state.issues, self.state.docs_changes,
+                    self._prs_by_number, self._issues_by_number, self._repo_context
+                ))
                 return "generate_topics"
             return "input_github_repo"
         except Exception as e:
@@ -302,41 +350,28 @@ class DevRelPublisherFlow(Flow[DevRelAgentState]):
         })
         
         # Use AI to analyze the data and generate topics
-        response = await copilotkit_stream(
-            completion(
-                model="openai/gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"""
-                        Here's the GitHub repository data to analyze:
-                        
-                        Issues: {json.dumps([{
-                            "number": i["number"],
-                            "title": i["title"],
-                            "state": i["state"],
-                            "created_at": i["created_at"]
-                        } for i in self.state.issues[:10]])}
-                        
-                        Pull Requests: {json.dumps([{
-                            "number": p["number"],
-                            "title": p["title"],
-                            "state": p.get("state", "unknown"),
-                            "created_at": p["created_at"]
-                        } for p in self.state.pull_requests[:10]])}
-                        
-                        Doc Changes: {json.dumps([{
-                            "files": [f["filename"] for f in d["doc_files"]]
-                        } for d in self.state.docs_changes[:10]])}
-                        
-                        Generate 5 compelling content topics based on this data.
-                    """}
-                ],
-                tools=[GENERATE_TOPIC_TOOL],
-                stream=True
-            )
+        message = await response_cache.complete(
+            stream_completion,
+            model=TOPIC_MODEL,
+            messages=[
+                system_message(system_prompt, TOPIC_MODEL),
+                # The repository data is the same for every retry, so it is
+                # cached along with the system prompt
+                cacheable_message("user", f"""
+                    Here's the GitHub repository data to analyze:
+                    
+                    {self._repo_context}
+                    
+                    Generate 5 compelling content topics based on this data.
+                """, TOPIC_MODEL)
+            ],
+            tools=cacheable_tools([GENERATE_TOPIC_TOOL], TOPIC_MODEL),
+            temperature=0,
+            validate=has_tool_call("generate_topic"),
+            semantic_key=self._repo_context,
+            semantic_scope=self.state.repo_url
         )
-        
-        message = response.choices[0].message
+        logger.info(f"LLM cache: {response_cache.stats}")
         message = sanitize_tool_call_arguments(message)
         self.state.messages.append(message)
         
@@ -346,18 +381,10 @@ class DevRelPublisherFlow(Flow[DevRelAgentState]):
                 if tool_call["function"]["name"] == "generate_topic":
                     try:
                         arguments_str = tool_call["function"]["arguments"]
-                        try:
-                            topic_data = json.loads(arguments_str)
-                        except json.JSONDecodeError:
-                            # Use regex to extract the first {...} block
-                            import re
-                            match = re.search(r'\{.*?\}', arguments_str, re.DOTALL)
-                            if match:
-                                clean_json = match.group(0)
-                                topic_data = json.loads(clean_json)
-                            else:
-                                print(f"Warning: Could not extract valid JSON from: {arguments_str}")
-                                continue
+                        topic_data = loads_tolerant(arguments_str)
+                        if topic_data is None:
+                            print(f"Warning: Could not extract valid JSON from: {arguments_str}")
+                            continue
                         self.state.topics.append(topic_data)
                     except Exception as e:
                         raise e
@@ -420,36 +447,45 @@ class DevRelPublisherFlow(Flow[DevRelAgentState]):
         # Context from repository data
         context = {}
         source_type = self.state.selected_topic.get("source_type")
-        source_id = self.state.selected_topic.get("source_id")
+        source_number = parse_issue_number(self.state.selected_topic.get("source_id"))
+        
+        # Unknown ids fall back to the most recent issue or PR
+        if source_type == "issue":
+            context = self._issues_by_number.get(source_number) or next(iter(self._issues_by_number.values()), {})
+        elif source_type == "pull_request":
+            context = self._prs_by_number.get(source_number) or next(iter(self._prs_by_number.values()), {})
         
-        if source_type == "issue" and self.state.issues:
-            context = next((i for i in self.state.issues if str(i["number"]) == source_id), self.state.issues[0] if self.state.issues else {})
-        elif source_type == "pull_request" and self.state.pull_requests:
-            context = next((p for p in self.state.pull_requests if str(p["number"]) == source_id), self.state.pull_requests[0] if self.state.pull_requests else {})
+        topic_prompt = f"""
+                    Topic: {self.state.selected_topic['title']}
+                    Description: {self.state.selected_topic['description']}
+                    Content Type: {content_type}
+                    
+                    Please create an engaging {content_type} about this topic.
+                """
         
         # Generate the content draft
-        response = await copilotkit_stream(
-            completion(
-                model="openai/gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"""
-                        Topic: {self.state.selected_topic['title']}
-                        Description: {self.state.selected_topic['description']}
-                        Content Type: {content_type}
-                        
-                        Additional Context:
-                        {json.dumps(context)}
-                        
-                        Please create an engaging {content_type} about this topic.
-                    """}
-                ],
-                tools=[*self.state.copilotkit.actions, WRITE_CONTENT_TOOL],
-                stream=True
-            )
+        message = await response_cache.complete(
+            stream_completion,
+            model=CONTENT_MODEL,
+            messages=[
+                system_message(system_prompt, CONTENT_MODEL),
+                # Source context comes before the topic so drafts about the
+                # same source share a cached prefix
+                cacheable_message("user", f"""
+                    Additional Context:
+                    {dumps(context)}
+                """, CONTENT_MODEL),
+                {"role": "user", "content": topic_prompt}
+            ],
+            tools=cacheable_tools([WRITE_CONTENT_TOOL], CONTENT_MODEL, self.state.copilotkit.actions),
+            temperature=0,
+            validate=has_tool_call("write_content"),
+            # A similar topic can reuse a draft of the same type about the
+            # same source; only the topic is compared
+            semantic_key=f"{self.state.selected_topic['title']}\n{self.state.selected_topic['description']}",
+            semantic_scope=f"{content_type}\n{dumps(context)}"
         )
-        
-        message = response.choices[0].message
+        logger.info(f"LLM cache: {response_cache.stats}")
         message = sanitize_tool_call_arguments(message)
         self.state.messages.append(message)
         
@@ -460,18 +496,10 @@ class DevRelPublisherFlow(Flow[DevRelAgentState]):
                     try:
                         # Get raw arguments string
                         arguments_str = tool_call["function"]["arguments"]
-                        try:
-                            content_data = json.loads(arguments_str)
-                        except json.JSONDecodeError:
-                            # Use regex to extract the first {...} block
-                            import re
-                            match = re.search(r'\{.*?\}', arguments_str, re.DOTALL)
-                            if match:
-                                clean_json = match.group(0)
-                                content_data = json.loads(clean_json)
-                            else:
-                                print(f"Warning: Could not extract valid JSON from: {arguments_str}")
-                                continue
+                        content_data = loads_tolerant(arguments_str)
+                        if content_data is None:
+                            print(f"Warning: Could not extract valid JSON from: {arguments_str}")
+                            continue
                         self.state.content_drafts[content_type] = content_data.get("content", "")
                         # Also save to content record
                         self.state.content_record = {
@@ -513,61 +541,54 @@ class DevRelPublisherFlow(Flow[DevRelAgentState]):
         Save the final content to the database.
         Inserts a record into the content table.
         """
-        try:
-            # Use the database helper module to insert content
-            from sample_agent.db import insert_content
-            
-            # Insert the content record and get the ID
-            content_id = insert_content(self.state.content_record)
-            
-            # Check if insert was successful
-            if content_id == -1:
-                # Database operation failed but we can continue
-                self.state.messages = sanitize_all_messages(self.state.messages)
-                state_dict = self.state.__dict__ if hasattr(self.state, "__dict__") else dict(self.state)
-                await copilotkit_emit_state({
-                    **state_dict,
-                    "status": "Database not available. Content generated but not saved."
-                })
-            else:
-                # Update state with the new ID
-                self.state.content_record["id"] = content_id
-                
-                # Emit state update with success message
-                self.state.messages = sanitize_all_messages(self.state.messages)
-                state_dict = self.state.__dict__ if hasattr(self.state, "__dict__") else dict(self.state)
-                await copilotkit_emit_state({
-                    **state_dict,
-                    "status": f"Content saved to database with ID: {content_id}"
-                })
-            
+        # The database is optional; without its driver, content is
+        # generated but not saved
+        if not driver_available():
+            self._db_task = None
+            self.state.status = "Database not available. Content generated but not saved."
+            await copilotkit_emit_state({"status": self.state.status})
             return "flow_complete"
-            
+
+        # Queue the content record for the background writer; flow_complete
+        # waits for its ID, so the insert overlaps with the flow's remaining steps
+        self._db_task = content_writer.save(self.state.content_record)
+        return "flow_complete"
+    
+    async def wait_for_database(self):
+        """Wait for the background insert and record its outcome in state."""
+        if self._db_task is None:
+            return
+        try:
+            content_id = await self._db_task
         except Exception as e:
-            # Handle database errors
+            # Handle database errors; the flow still completes
             self.state.error = str(e)
-            
-            # Emit state update with error message
-            self.state.messages = sanitize_all_messages(self.state.messages)
-            state_dict = self.state.__dict__ if hasattr(self.state, "__dict__") else dict(self.state)
-            await copilotkit_emit_state({
-                **state_dict,
-                "status": f"Database error: {str(e)}"
-            })
-            raise e
-            
-            # Still proceed to complete the flow
-            return "flow_complete"
+            self.state.status = f"Database error: {str(e)}"
+            return
+        
+        # Check if insert was successful
+        if content_id == -1:
+            # Database operation failed but we can continue
+            self.state.status = "Database not available. Content generated but not saved."
+        else:
+            # Update state with the new ID
+            self.state.content_record["id"] = content_id
+            self.state.status = f"Content saved to database with ID: {content_id}"
     
     @listen("flow_complete")
     async def flow_complete(self):
         # Optionally, you can log or print for debugging
         print("FLOW COMPLETE CALLED")
 
-        # 1. Emit the final state (this will send the blog post to the frontend)
-        self.state.messages = sanitize_all_messages(self.state.messages)
+        # The content ID and save status are part of the final state
+        await self.wait_for_database()
+
+        # 1. Emit the final state (this will send the blog post to the frontend).
+        # The UI treats each emit as a snapshot, so the whole state goes out,
+        # along with the LLM cache stats for the run.
+        # Messages were sanitized as they were appended, so they go out as-is
         state_dict = self.state.__dict__ if hasattr(self.state, "__dict__") else dict(self.state)
-        await copilotkit_emit_state(state_dict)
+        await copilotkit_emit_state({**state_dict, "llm_cache": response_cache.stats})
 
         # 2. Explicitly exit the agent loop (recommended for clean session end)
         await copilotkit_exit()
@@ -576,31 +597,12 @@ class DevRelPublisherFlow(Flow[DevRelAgentState]):
         return None
 
 # Tool handlers
-def fetch_github_data_handler(args):
+async def fetch_github_data_handler(args):
     """Handler for fetch_github_data tool."""
     try:
         owner, repo = extract_repo_info(args["repo_url"])
-        data_type = args["data_type"]
-        start_date = args["start_date"]
-        
-        result = {}
-        
-        if data_type in ["commits", "all"]:
-            commits_endpoint = f"repos/{owner}/{repo}/commits"
-            commits_params = {"since": f"{start_date}T00:00:00Z"}
-            result["commits"] = github_api_request(commits_endpoint, commits_params)
-            
-        if data_type in ["issues", "all"]:
-            issues_endpoint = f"repos/{owner}/{repo}/issues"
-            issues_params = {"state": "all", "since": f"{start_date}T00:00:00Z"}
-            result["issues"] = github_api_request(issues_endpoint, issues_params)
-            
-        if data_type in ["pull_requests", "all"]:
-            prs_endpoint = f"repos/{owner}/{repo}/pulls"
-            prs_params = {"state": "all"}
-            result["pull_requests"] = github_api_request(prs_endpoint, prs_params)
-        
-        return json.dumps(result)
+        result = await fetch_repository_data(owner, repo, args["start_date"], args["data_type"])
+        return dumps(result)
     
     except Exception as e:
         raise e
@@ -613,25 +615,20 @@ tool_handlers = {
 def sanitize_tool_call_arguments(message):
     """
     For each tool call in the message, ensure the arguments field is a valid JSON object (as a string).
-    If not, extract the first JSON object using regex.
+    If not, extract the first balanced JSON object.
     """
     if "tool_calls" in message:
         for tool_call in message["tool_calls"]:
             args_str = tool_call["function"]["arguments"]
             try:
                 # Try to parse as is
-                json.loads(args_str)
+                loads(args_str)
             except json.JSONDecodeError:
-                # Extract first {...} block
-                match = re.search(r'\{.*?\}', args_str, re.DOTALL)
-                if match:
-                    clean_json = match.group(0)
+                # Extract first {...} block, keeping nested objects whole
+                clean_json = extract_json_object(args_str)
+                if clean_json:
                     tool_call["function"]["arguments"] = clean_json
                 else:
                     # If no valid JSON, set to empty object
                     tool_call["function"]["arguments"] = "{}"
     return message
-
-# Utility to sanitize all messages in a list
-def sanitize_all_messages(messages):
-    return [sanitize_tool_call_arguments(m) for m in messages]
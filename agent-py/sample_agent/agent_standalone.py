@@ -3,20 +3,41 @@ DevRel publishing agent that generates content from GitHub repo changes.
 Standalone version without CopilotKit dependencies.
 """
 
-import json
-import os
-import re
-import uuid
-from datetime import datetime
-from typing import List, Dict, Optional, TypedDict, Any
-from typing_extensions import Literal
+import asyncio
 
-import psycopg2
-import requests
 from dotenv import load_dotenv
-from litellm import completion
 from crewai.flow.flow import Flow, start, router, listen
 
+from sample_agent.github import (
+    close_client,
+    extract_repo_info,
+    github_api_paginate,
+    fetch_recent_pull_requests,
+    fetch_repository_data,
+    fetch_commit_files,
+    fetch_commit_details,
+    fetch_doc_commit_shas,
+    project_commit,
+    project_issue,
+    issue_details,
+    is_doc_file,
+    parse_issue_number
+)
+from sample_agent.llm import (
+    TOPIC_MODEL,
+    CONTENT_MODEL,
+    cacheable_message,
+    system_message,
+    cacheable_tools,
+    compact_context,
+    dumps,
+    has_tool_call,
+    loads_tolerant,
+    stream_tool_calls
+)
+from sample_agent.llm_cache import LLMResponseCache
+from sample_agent.db import content_writer
+
 # Load environment variables
 load_dotenv()
 
@@ -113,32 +134,14 @@ WRITE_CONTENT_TOOL = {
     }
 }
 
-# GitHub API helpers
-def extract_repo_info(repo_url: str) -> tuple:
-    """Extract owner and repo name from GitHub URL."""
-    pattern = r"github\.com/([^/]+)/([^/]+)"
-    match = re.search(pattern, repo_url)
-    if match:
-        owner, repo = match.groups()
-        return owner, repo
-    raise ValueError(f"Invalid GitHub URL: {repo_url}")
+# Serves repeated topic and draft requests without another LLM round-trip
+response_cache = LLMResponseCache()
 
-def github_api_request(endpoint: str, params: Dict = None) -> Dict:
-    """Make a request to GitHub API with proper auth and error handling."""
-    github_token = os.getenv("GITHUB_TOKEN")
-    headers = {
-        "Accept": "application/vnd.github.v3+json",
-    }
-    if github_token:
-        headers["Authorization"] = f"token {github_token}"
-    
-    base_url = "https://api.github.com"
-    response = requests.get(f"{base_url}/{endpoint}", headers=headers, params=params)
-    
-    if response.status_code != 200:
-        raise Exception(f"GitHub API error: {response.status_code} - {response.text}")
-    
-    return response.json()
+async def stream_completion(**kwargs):
+    """Stream a completion and assemble the assistant message from its chunks."""
+    from litellm import acompletion
+    response = await acompletion(**kwargs, stream=True)
+    return await stream_tool_calls(response)
 
 class DevRelAgentState:
     """
@@ -167,6 +170,9 @@ class DevRelAgentState:
             "social_media": ""
         }
         
+        # One database record per drafted topic
+        self.content_records = []
+        
         # Database Record
         self.content_record = {
             "channel": "",
@@ -225,50 +231,71 @@ class DevRelPublisherFlow(Flow[DevRelAgentState]):
             # Show progress
             print("Analyzing repository...")
             
-            # Fetch commits
+            # Fetch commits, issues and pull requests concurrently
+            start_iso = f"{self.state.start_date}T00:00:00Z"
             commits_endpoint = f"repos/{owner}/{repo}/commits"
-            commits_params = {"since": f"{self.state.start_date}T00:00:00Z"}
-            self.state.commits = github_api_request(commits_endpoint, commits_params)
-            
-            # Show progress
-            print(f"Found {len(self.state.commits)} commits")
-            
-            # Fetch issues
+            commits_params = {"since": start_iso}
             issues_endpoint = f"repos/{owner}/{repo}/issues"
-            issues_params = {"state": "all", "since": f"{self.state.start_date}T00:00:00Z"}
-            self.state.issues = github_api_request(issues_endpoint, issues_params)
+            issues_params = {"state": "all", "since": start_iso}
+            all_commits, all_issues, recent_prs = await asyncio.gather(
+                github_api_paginate(commits_endpoint, commits_params),
+                github_api_paginate(issues_endpoint, issues_params),
+                fetch_recent_pull_requests(owner, repo, start_iso)
+            )
+            
+            # Keep only the fields the prompts use; issue and PR bodies are
+            # kept aside for drafting about a single source
+            self.state.commits = [project_commit(c) for c in all_commits]
+            self.state.issues = [project_issue(i) for i in all_issues]
+            self.state.pull_requests = [project_issue(pr) for pr in recent_prs]
+            self._commits_by_sha = {c["sha"]: c for c in self.state.commits}
+            self._issues_by_number = {i["number"]: issue_details(i) for i in all_issues}
+            self._prs_by_number = {pr["number"]: issue_details(pr) for pr in recent_prs}
             
+            print(f"Found {len(self.state.commits)} commits")
             print(f"Found {len(self.state.issues)} issues")
+            print(f"Found {len(self.state.pull_requests)} pull requests")
             
-            # Fetch pull requests
-            prs_endpoint = f"repos/{owner}/{repo}/pulls"
-            prs_params = {"state": "all"}
-            self.state.pull_requests = [
-                pr for pr in github_api_request(prs_endpoint, prs_params)
-                if datetime.strptime(pr["created_at"], "%Y-%m-%dT%H:%M:%SZ") >= datetime.strptime(self.state.start_date, "%Y-%m-%d")
-            ]
+            # Check for documentation changes, fetching file lists for all
+            # commits in one GraphQL query
+            commit_files = await fetch_commit_files(owner, repo, self.state.start_date)
             
-            print(f"Found {len(self.state.pull_requests)} pull requests")
+            # Commits that did not merge a pull request fall back to the
+            # commit detail endpoint, but only those the path-filtered commit
+            # lists show touching documentation
+            missing_shas = [c["sha"] for c in self.state.commits if c["sha"] not in commit_files]
+            if missing_shas:
+                doc_shas = await fetch_doc_commit_shas(owner, repo, self.state.start_date)
+                missing_shas = [sha for sha in missing_shas if sha in doc_shas]
+            details = await fetch_commit_details(owner, repo, missing_shas)
+            for sha, commit_data in zip(missing_shas, details):
+                commit_files[sha] = [f["filename"] for f in commit_data.get("files", [])]
             
-            # Check for documentation changes
             docs_changes = []
             for commit in self.state.commits:
-                commit_endpoint = f"repos/{owner}/{repo}/commits/{commit['sha']}"
-                commit_data = github_api_request(commit_endpoint)
-                
-                if "files" in commit_data:
-                    doc_files = [f for f in commit_data["files"] 
-                               if f["filename"].endswith((".md", ".mdx", ".txt", "CHANGELOG", "README"))]
-                    if doc_files:
-                        docs_changes.append({
-                            "commit": commit,
-                            "doc_files": doc_files
-                        })
+                filenames = commit_files.get(commit["sha"], [])
+                doc_files = [{"filename": name} for name in filenames if is_doc_file(name)]
+                if doc_files:
+                    docs_changes.append({
+                        "commit": commit,
+                        "doc_files": doc_files
+                    })
             
             self.state.docs_changes = docs_changes
             
             print(f"Found {len(self.state.docs_changes)} documentation changes")
             
+            # Serialized once here so topic retries reuse it
+            self._repo_context = compact_context(
+                commits=self.state.commits,
+                issues=self.state.issues,
+                pull_requests=self.state.pull_requests,
+                doc_changes=[{
+                    "commit_message": d["commit"]["message"],
+                    "files": [f["filename"] for f in d["doc_files"]]
+                } for d in self.state.docs_changes]
+            )
+            
             # If we have data, proceed to generate topics
             if (self.state.commits or self.state.issues or 
                 self.state.pull_requests or self.state.docs_changes):
@@ -306,46 +333,28 @@ class DevRelPublisherFlow(Flow[DevRelAgentState]):
         print("Generating content topics...")
         
         # Use AI to analyze the data and generate topics
-        response = await completion(
-            model="openai/gpt-4o",
+        message = await response_cache.complete(
+            stream_completion,
+            model=TOPIC_MODEL,
             messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"""
+                system_message(system_prompt, TOPIC_MODEL),
+                # The repository data is the same for every retry, so it is
+                # cached along with the system prompt
+                cacheable_message("user", f"""
                     Here's the GitHub repository data to analyze:
                     
-                    Commits: {json.dumps([{
-                        "sha": c["sha"],
-                        "message": c["commit"]["message"],
-                        "date": c["commit"]["author"]["date"]
-                    } for c in self.state.commits[:10]])}
-                    
-                    Issues: {json.dumps([{
-                        "number": i["number"],
-                        "title": i["title"],
-                        "state": i["state"],
-                        "created_at": i["created_at"]
-                    } for i in self.state.issues[:10]])}
-                    
-                    Pull Requests: {json.dumps([{
-                        "number": p["number"],
-                        "title": p["title"],
-                        "state": p["state"],
-                        "created_at": p["created_at"]
-                    } for p in self.state.pull_requests[:10]])}
-                    
-                    Doc Changes: {json.dumps([{
-                        "commit_message": d["commit"]["commit"]["message"],
-                        "files": [f["filename"] for f in d["doc_files"]]
-                    } for d in self.state.docs_changes[:10]])}
+                    {self._repo_context}
                     
                     Generate 5 compelling content topics based on this data.
-                """}
+                """, TOPIC_MODEL)
             ],
-            tools=[GENERATE_TOPIC_TOOL],
-            stream=False
+            tools=cacheable_tools([GENERATE_TOPIC_TOOL], TOPIC_MODEL),
+            temperature=0,
+            validate=has_tool_call("generate_topic"),
+            semantic_key=self._repo_context,
+            semantic_scope=self.state.repo_url
         )
-        
-        message = response.choices[0].message
+        print(f"LLM cache: {response_cache.hits} hits, {response_cache.semantic_hits} similar, {response_cache.misses} misses")
         self.state.messages.append(message)
         
         # Process tool calls to extract topics
@@ -355,22 +364,12 @@ class DevRelPublisherFlow(Flow[DevRelAgentState]):
                     try:
                         # Get raw arguments string
                         arguments_str = tool_call["function"]["arguments"]
-                        
-                        # Clean up potentially malformed JSON - find the first '{' and last '}'
-                        start = arguments_str.find('{')
-                        end = arguments_str.rfind('}') + 1
-                        
-                        if start != -1 and end > start:
-                            # Extract valid JSON object
-                            clean_json = arguments_str[start:end]
-                            topic_data = json.loads(clean_json)
-                            self.state.topics.append(topic_data)
-                            print(f"Generated topic: {topic_data['title']}")
-                        else:
-                            # Fallback if we can't extract valid JSON
+                        topic_data = loads_tolerant(arguments_str)
+                        if topic_data is None:
                             print(f"Warning: Could not extract valid JSON from: {arguments_str}")
-                    except json.JSONDecodeError as e:
-                        print(f"JSON parsing error: {e} in: {tool_call['function']['arguments']}")
+                            continue
+                        self.state.topics.append(topic_data)
+                        print(f"Generated topic: {topic_data.get('title')}")
                     except Exception as e:
                         print(f"Error processing tool call: {e}")
         
@@ -382,102 +381,127 @@ class DevRelPublisherFlow(Flow[DevRelAgentState]):
         print("No topics generated, retrying...")
         return "generate_topics"
     
-    @router(generate_topics)
-    async def generate_content_drafts(self):
-        """
-        Generate content drafts based on the selected topic.
-        Creates drafts for blog posts, code examples, and social media.
+    async def draft_topic(self, system_prompt, topic):
         """
-        system_prompt = """
-        You are a DevRel content creator writing about technical topics.
-        Create professional, engaging content for the selected topic.
-        Generate content that clearly explains the technical details while
-        keeping it accessible to the target audience.
+        Draft content for one topic.
         
-        Use the write_content tool to submit your draft.
+        Returns the assistant message and the content record built from its
+        write_content call, or None if it did not produce one.
         """
-        
-        print("Generating content draft...")
-        
-        # Get which content type to generate
-        self.state.selected_topic = self.state.topics[0]
-        content_type = self.state.selected_topic.get("content_types", ["blog_post"])[0]
-        
-        print(f"Selected topic: {self.state.selected_topic['title']}")
-        print(f"Generating content type: {content_type}")
+        # Get which content type to generate; topics come from the model, so
+        # any field may be missing or empty
+        content_type = (topic.get("content_types") or ["blog_post"])[0]
+        title = topic.get("title") or "Topic"
+        description = topic.get("description") or ""
         
         # Context from repository data
         context = {}
-        source_type = self.state.selected_topic.get("source_type")
-        source_id = self.state.selected_topic.get("source_id")
+        source_type = topic.get("source_type")
+        source_id = topic.get("source_id")
         
         if source_type == "commit":
-            context = next((c for c in self.state.commits if c["sha"] == source_id), {})
+            context = self._commits_by_sha.get(source_id, {})
         elif source_type == "issue":
-            context = next((i for i in self.state.issues if str(i["number"]) == source_id), {})
+            context = self._issues_by_number.get(parse_issue_number(source_id), {})
         elif source_type == "pull_request":
-            context = next((p for p in self.state.pull_requests if str(p["number"]) == source_id), {})
+            context = self._prs_by_number.get(parse_issue_number(source_id), {})
         
-        # Generate the content draft
-        response = await completion(
-            model="openai/gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"""
-                    Topic: {self.state.selected_topic['title']}
-                    Description: {self.state.selected_topic['description']}
+        topic_prompt = f"""
+                    Topic: {title}
+                    Description: {description}
                     Content Type: {content_type}
                     
-                    Additional Context:
-                    {json.dumps(context)}
-                    
                     Please create an engaging {content_type} about this topic.
-                """}
+                """
+        
+        # Generate the content draft; concurrent drafts are reported below
+        # as each one finishes, whether it was generated or cached
+        message = await response_cache.complete(
+            stream_completion,
+            model=CONTENT_MODEL,
+            messages=[
+                system_message(system_prompt, CONTENT_MODEL),
+                # Source context comes before the topic so drafts about the
+                # same source share a cached prefix
+                cacheable_message("user", f"""
+                    Additional Context:
+                    {dumps(context)}
+                """, CONTENT_MODEL),
+                {"role": "user", "content": topic_prompt}
             ],
-            tools=[WRITE_CONTENT_TOOL],
-            stream=False
+            tools=cacheable_tools([WRITE_CONTENT_TOOL], CONTENT_MODEL),
+            temperature=0,
+            validate=has_tool_call("write_content"),
+            # A similar topic can reuse a draft of the same type about the
+            # same source; only the topic is compared
+            semantic_key=f"{title}\n{description}",
+            semantic_scope=f"{content_type}\n{dumps(context)}"
         )
         
-        message = response.choices[0].message
-        self.state.messages.append(message)
-        
         # Process tool calls to extract content
-        if message.get("tool_calls"):
-            for tool_call in message.get("tool_calls", []):
-                if tool_call["function"]["name"] == "write_content":
-                    try:
-                        # Get raw arguments string
-                        arguments_str = tool_call["function"]["arguments"]
-                        
-                        # Clean up potentially malformed JSON
-                        start = arguments_str.find('{')
-                        end = arguments_str.rfind('}') + 1
-                        
-                        if start != -1 and end > start:
-                            # Extract valid JSON object
-                            clean_json = arguments_str[start:end]
-                            content_data = json.loads(clean_json)
-                            
-                            self.state.content_drafts[content_type] = content_data.get("content", "")
-                            
-                            # Also save to content record
-                            self.state.content_record = {
-                                "channel": content_type,
-                                "title": content_data.get("title", f"Article about {self.state.selected_topic.get('title', 'Topic')}"),
-                                "summary": content_data.get("summary", ""),
-                                "content": content_data.get("content", ""),
-                                "type": content_type
-                            }
-                            
-                            print(f"Generated content: {content_data.get('title')}")
-                            print(f"Summary: {content_data.get('summary')}")
-                        else:
-                            # Fallback if we can't extract valid JSON
-                            print(f"Warning: Could not extract valid JSON from: {arguments_str}")
-                    except json.JSONDecodeError as e:
-                        print(f"JSON parsing error: {e} in: {tool_call['function']['arguments']}")
-                    except Exception as e:
-                        print(f"Error processing tool call: {e}")
+        for tool_call in message.get("tool_calls") or []:
+            if tool_call["function"]["name"] == "write_content":
+                try:
+                    # Get raw arguments string
+                    arguments_str = tool_call["function"]["arguments"]
+                    content_data = loads_tolerant(arguments_str)
+                    if content_data is None:
+                        print(f"Warning: Could not extract valid JSON from: {arguments_str}")
+                        continue
+                    
+                    print(f"Generated {content_type}: {content_data.get('title')}")
+                    print(f"Summary: {content_data.get('summary')}")
+                    return message, {
+                        "channel": content_type,
+                        "title": content_data.get("title", f"Article about {title}"),
+                        "summary": content_data.get("summary", ""),
+                        "content": content_data.get("content", ""),
+                        "type": content_type
+                    }
+                except Exception as e:
+                    print(f"Error processing tool call: {e}")
+        
+        return message, None
+    
+    @router(generate_topics)
+    async def generate_content_drafts(self):
+        """
+        Generate content drafts for every topic.
+        Creates drafts for blog posts, code examples, and social media.
+        """
+        system_prompt = """
+        You are a DevRel content creator writing about technical topics.
+        Create professional, engaging content for the selected topic.
+        Generate content that clearly explains the technical details while
+        keeping it accessible to the target audience.
+        
+        Use the write_content tool to submit your draft.
+        """
+        
+        print(f"Generating content drafts for {len(self.state.topics)} topics...")
+        
+        # Draft every topic concurrently; the first one is the selected topic.
+        # A failed draft is reported and skipped without losing the others
+        self.state.selected_topic = self.state.topics[0]
+        outcomes = await asyncio.gather(*(
+            self.draft_topic(system_prompt, topic) for topic in self.state.topics
+        ), return_exceptions=True)
+        results = []
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                print(f"Error drafting a topic: {outcome}")
+            else:
+                results.append(outcome)
+        print(f"LLM cache: {response_cache.hits} hits, {response_cache.semantic_hits} similar, {response_cache.misses} misses")
+        
+        self.state.messages.extend(message for message, _ in results)
+        self.state.content_records = [record for _, record in results if record]
+        # Keep the first draft of each content type
+        for record in self.state.content_records:
+            if not self.state.content_drafts.get(record["type"]):
+                self.state.content_drafts[record["type"]] = record["content"]
+        if self.state.content_records:
+            self.state.content_record = self.state.content_records[0]
         
         return "save_to_database"
     
@@ -485,34 +509,38 @@ class DevRelPublisherFlow(Flow[DevRelAgentState]):
     async def save_to_database(self):
         """
         Save the final content to the database.
-        Inserts a record into the content table.
+        Inserts one record per draft into the content table, in a single batch.
         """
+        records = self.state.content_records or [self.state.content_record]
+        print(f"Saving {len(records)} content records to database...")
+        
+        # Queue every draft for the background writer, which inserts them
+        # in one batch; flow_complete waits for the IDs
+        self._db_task = asyncio.gather(*(content_writer.save(record) for record in records))
+        self._db_records = records
+        
+        return "flow_complete"
+    
+    async def wait_for_database(self):
+        """Wait for the background insert and assign the new IDs."""
         try:
-            # Use the database helper module to insert content
-            from sample_agent.db import insert_content
-            
-            print("Saving content to database...")
-            
-            # Insert the content record and get the ID
-            content_id = insert_content(self.state.content_record)
-            
-            # Update state with the new ID
-            self.state.content_record["id"] = content_id
-            
-            print(f"Content saved with ID: {content_id}")
-            
-            return "flow_complete"
-            
+            content_ids = await self._db_task
         except Exception as e:
             # Handle database errors
             self.state.error = str(e)
             print(f"Database error: {str(e)}")
-            
-            return "flow_complete"
+            return
+        
+        # Update state with the new IDs; content_record is the first draft
+        for record, content_id in zip(self._db_records, content_ids):
+            record["id"] = content_id
+        
+        print(f"Content saved with IDs: {', '.join(map(str, content_ids))}")
     
     @listen("flow_complete")
     async def flow_complete(self):
         """End the flow."""
+        await self.wait_for_database()
         print("Flow complete!")
         print(f"Content title: {self.state.content_record['title']}")
         print(f"Content summary: {self.state.content_record['summary']}")
@@ -521,41 +549,24 @@ class DevRelPublisherFlow(Flow[DevRelAgentState]):
         print("\nDone!")
 
 # Tool handlers
-def fetch_github_data_handler(args):
+async def fetch_github_data_handler(args):
     """Handler for fetch_github_data tool."""
     try:
         owner, repo = extract_repo_info(args["repo_url"])
-        data_type = args["data_type"]
-        start_date = args["start_date"]
-        
-        result = {}
-        
-        if data_type in ["commits", "all"]:
-            commits_endpoint = f"repos/{owner}/{repo}/commits"
-            commits_params = {"since": f"{start_date}T00:00:00Z"}
-            result["commits"] = github_api_request(commits_endpoint, commits_params)
-            
-        if data_type in ["issues", "all"]:
-            issues_endpoint = f"repos/{owner}/{repo}/issues"
-            issues_params = {"state": "all", "since": f"{start_date}T00:00:00Z"}
-            result["issues"] = github_api_request(issues_endpoint, issues_params)
-            
-        if data_type in ["pull_requests", "all"]:
-            prs_endpoint = f"repos/{owner}/{repo}/pulls"
-            prs_params = {"state": "all"}
-            result["pull_requests"] = github_api_request(prs_endpoint, prs_params)
-        
-        return json.dumps(result)
+        result = await fetch_repository_data(owner, repo, args["start_date"], args["data_type"])
+        return dumps(result)
     except Exception as e:
-        return json.dumps({"error": str(e)})
+        return dumps({"error": str(e)})
 
 # Main entry point for standalone execution
-# async def run_flow():
-#     """Run the flow as a standalone process."""
-    
+async def run_flow():
+    """Run the flow as a standalone process."""
+    flow = DevRelPublisherFlow()
+    try:
+        await flow.kickoff_async()
+    finally:
+        # The GitHub client lives as long as the event loop
+        await close_client()
 
 if __name__ == "__main__":
-    flow = DevRelPublisherFlow()
-    # flow.state = DevRelAgentState()
-    # await flow.start_flow()
-    flow.kickoff()
\ No newline at end of file
+    asyncio.run(run_flow())
\ No newline at end of file
@@ -2,23 +2,105 @@
 Database setup script for the DevRel publisher agent.
 """
 
+import asyncio
+import atexit
+import importlib.util
 import os
-import psycopg2
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+def driver_available():
+    """
+    Whether the PostgreSQL driver is installed, checked without importing it.
+    """
+    return importlib.util.find_spec("psycopg2") is not None
+
+# psycopg2 is imported where it is first needed, so importing this module
+# does not load libpq
+
 def get_db_connection():
     """
     Create and return a database connection using environment variables.
     """
+    import psycopg2
+    
     db_url = os.getenv("POSTGRESQL_URL")
     if not db_url:
         raise ValueError("POSTGRESQL_URL environment variable not set")
     
     return psycopg2.connect(db_url)
 
+# Connections shared across saves, so each insert skips the connect handshake
+_pool = None
+
+def get_db_pool():
+    """
+    Return the shared connection pool, creating it on first use.
+    """
+    global _pool
+    if _pool is None:
+        db_url = os.getenv("POSTGRESQL_URL")
+        if not db_url:
+            raise ValueError("POSTGRESQL_URL environment variable not set")
+        import psycopg2.pool
+        _pool = psycopg2.pool.ThreadedConnectionPool(
+            1, 8, db_url, connection_factory=_prepared_connection_class()
+        )
+        atexit.register(_pool.closeall)
+    return _pool
+
+# Inserts a batch of records from one array per column, so a single prepared
+# plan serves any batch size. Each row draws its ID from the identity sequence
+# next to its array position, and IDs are returned in that order
+CONTENT_INSERT_STATEMENT = """
+    PREPARE content_insert (text[], text[], text[], text[], text[]) AS
+    WITH input AS (
+        SELECT nextval(pg_get_serial_sequence('content', 'id')) AS id, t.*
+        FROM unnest($1, $2, $3, $4, $5) WITH ORDINALITY
+            AS t(channel, title, summary, content, type, ordinal)
+    ), inserted AS (
+        INSERT INTO content (id, channel, title, summary, content, type)
+        OVERRIDING SYSTEM VALUE
+        SELECT id, channel, title, summary, content, type FROM input ORDER BY ordinal
+        RETURNING id
+    )
+    SELECT input.id FROM input JOIN inserted USING (id) ORDER BY input.ordinal
+"""
+
+_connection_class = None
+
+def _prepared_connection_class():
+    """
+    Return a connection class that remembers whether its statements are prepared.
+    
+    Prepared statements belong to a session, so each pooled connection
+    prepares them on first use.
+    """
+    global _connection_class
+    if _connection_class is None:
+        import psycopg2.extensions
+        
+        class PreparedConnection(psycopg2.extensions.connection):
+            content_insert_prepared = False
+        
+        _connection_class = PreparedConnection
+    return _connection_class
+
+@contextmanager
+def pooled_connection():
+    """
+    Borrow a connection from the shared pool, returning it when the block exits.
+    """
+    pool = get_db_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
 def setup_database():
     """
     Create the necessary database tables if they don't exist.
@@ -48,6 +130,45 @@ def setup_database():
         cursor.close()
         conn.close()
 
+def insert_contents(content_records):
+    """
+    Insert several content records in one round trip.
+    
+    Args:
+        content_records (list): Dictionaries with keys matching the content table columns
+    
+    Returns:
+        list: IDs of the inserted records, in the same order
+    """
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        
+        try:
+            if not conn.content_insert_prepared:
+                cursor.execute(CONTENT_INSERT_STATEMENT)
+                conn.content_insert_prepared = True
+            
+            cursor.execute(
+                "EXECUTE content_insert (%s, %s, %s, %s, %s)",
+                (
+                    [record["channel"] for record in content_records],
+                    [record["title"] for record in content_records],
+                    [record["summary"] for record in content_records],
+                    [record["content"] for record in content_records],
+                    [record["type"] for record in content_records]
+                )
+            )
+            content_ids = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+            
+            return content_ids
+        except Exception as e:
+            print(f"Database insertion error: {str(e)}")
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
 def insert_content(content_record):
     """
     Insert a content record into the database.
@@ -58,38 +179,54 @@ def insert_content(content_record):
     Returns:
         int: ID of the inserted record
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    return insert_contents([content_record])[0]
+
+class ContentWriter:
+    """
+    Saves content records from a background task, off the request path.
     
-    try:
-        query = """
-            INSERT INTO content (channel, title, summary, content, type)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING id
+    Records queued while an insert is running are written together in the
+    next batch, so concurrent flows share one round trip.
+    """
+    
+    def __init__(self):
+        self._queue = None
+        self._worker = None
+    
+    def save(self, content_record):
         """
+        Queue a record for insertion.
         
-        cursor.execute(
-            query, 
-            (
-                content_record["channel"],
-                content_record["title"],
-                content_record["summary"],
-                content_record["content"],
-                content_record["type"]
-            )
-        )
-        
-        content_id = cursor.fetchone()[0]
-        conn.commit()
-        
-        return content_id
-    except Exception as e:
-        print(f"Database insertion error: {str(e)}")
-        conn.rollback()
-        raise
-    finally:
-        cursor.close()
-        conn.close()
+        Returns:
+            asyncio.Future: Resolves to the new record's ID
+        """
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._worker.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._drain())
+        future = loop.create_future()
+        self._queue.put_nowait((content_record, future))
+        return future
+    
+    async def _drain(self):
+        while True:
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            
+            try:
+                content_ids = await asyncio.to_thread(insert_contents, [record for record, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), content_id in zip(batch, content_ids):
+                if not future.done():
+                    future.set_result(content_id)
+
+# Shared by every flow in the process
+content_writer = ContentWriter()
 
 def get_content(content_id=None, content_type=None, limit=10):
     """
@@ -103,34 +240,138 @@ def get_content(content_id=None, content_type=None, limit=10):
     Returns:
         list: List of content records
     """
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        
+        try:
+            # Postgres builds the list of row objects itself and psycopg2
+            # decodes the json result, so no rows are converted in Python
+            if content_id:
+                query = "SELECT json_agg(c) FROM (SELECT * FROM content WHERE id = %s) c"
+                cursor.execute(query, (content_id,))
+            elif content_type:
+                query = """
+                    SELECT json_agg(c) FROM (
+                        SELECT * FROM content WHERE type = %s ORDER BY id DESC LIMIT %s
+                    ) c
+                """
+                cursor.execute(query, (content_type, limit))
+            else:
+                query = "SELECT json_agg(c) FROM (SELECT * FROM content ORDER BY id DESC LIMIT %s) c"
+                cursor.execute(query, (limit,))
+        
+            # json_agg returns NULL rather than an empty array when nothing matches
+            return cursor.fetchone()[0] or []
+        except Exception as e:
+            print(f"Database query error: {str(e)}")
+            raise
+        finally:
+            cursor.close()
+
+def setup_semantic_cache(dimensions=1536):
+    """
+    Create the pgvector table backing the semantic LLM response cache.
+    
+    Args:
+        dimensions (int, optional): Size of the prompt embeddings
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
-        if content_id:
-            query = "SELECT * FROM content WHERE id = %s"
-            cursor.execute(query, (content_id,))
-        elif content_type:
-            query = "SELECT * FROM content WHERE type = %s ORDER BY id DESC LIMIT %s"
-            cursor.execute(query, (content_type, limit))
-        else:
-            query = "SELECT * FROM content ORDER BY id DESC LIMIT %s"
-            cursor.execute(query, (limit,))
-        
-        columns = [desc[0] for desc in cursor.description]
-        results = []
-        
-        for row in cursor.fetchall():
-            results.append(dict(zip(columns, row)))
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS llm_semantic_cache (
+                id INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                namespace TEXT NOT NULL,
+                embedding vector({int(dimensions)}) NOT NULL,
+                response JSONB NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS llm_semantic_cache_embedding_idx
+            ON llm_semantic_cache USING hnsw (embedding vector_cosine_ops)
+        """)
         
-        return results
+        conn.commit()
+        print("Semantic cache table created successfully.")
     except Exception as e:
-        print(f"Database query error: {str(e)}")
-        raise
+        print(f"Semantic cache setup error: {str(e)}")
+        conn.rollback()
     finally:
         cursor.close()
         conn.close()
 
+def _vector_literal(embedding):
+    """Format an embedding as a pgvector literal."""
+    return "[" + ",".join(str(float(x)) for x in embedding) + "]"
+
+def find_cached_response(namespace, embedding, min_similarity):
+    """
+    Find the cached response whose prompt embedding is closest to the given one.
+    
+    Args:
+        namespace (str): Partition of the cache, e.g. the model name
+        embedding (list): Embedding of the prompt
+        min_similarity (float): Minimum cosine similarity for a hit
+    
+    Returns:
+        dict: The cached response, or None if nothing is similar enough
+    """
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        
+        try:
+            vector = _vector_literal(embedding)
+            cursor.execute(
+                """
+                SELECT response, 1 - (embedding <=> %s::vector) AS similarity
+                FROM llm_semantic_cache
+                WHERE namespace = %s
+                ORDER BY embedding <=> %s::vector
+                LIMIT 1
+                """,
+                (vector, namespace, vector)
+            )
+            row = cursor.fetchone()
+            if row and row[1] >= min_similarity:
+                return row[0]
+            return None
+        except Exception as e:
+            print(f"Semantic cache lookup error: {str(e)}")
+            raise
+        finally:
+            cursor.close()
+
+def insert_cached_response(namespace, embedding, response):
+    """
+    Store a response in the semantic cache under its prompt embedding.
+    
+    Args:
+        namespace (str): Partition of the cache, e.g. the model name
+        embedding (list): Embedding of the prompt
+        response (dict): JSON-serializable response to cache
+    """
+    from psycopg2.extras import Json
+    
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute(
+                "INSERT INTO llm_semantic_cache (namespace, embedding, response) VALUES (%s, %s::vector, %s)",
+                (namespace, _vector_literal(embedding), Json(response))
+            )
+            conn.commit()
+        except Exception as e:
+            print(f"Semantic cache insertion error: {str(e)}")
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
 if __name__ == "__main__":
     # Run database setup when script is executed directly
-    setup_database() 
\ No newline at end of file
+    setup_database()
+    if os.getenv("DEVREL_SEMANTIC_CACHE"):
+        setup_semantic_cache() 
\ No newline at end of file
@@ -12,12 +12,15 @@ from copilotkit.integrations.fastapi import add_fastapi_endpoint
 from copilotkit import CopilotKitRemoteEndpoint
 from copilotkit.crewai import CrewAIAgent
 from sample_agent.db import setup_database
+from sample_agent.github import close_client
 from sample_agent.agent_new import DevRelPublisherFlow
 
 # Initialize database tables
 setup_database()
 
 app = FastAPI()
+# Every session shares the server loop's GitHub client; close it with the server
+app.add_event_handler("shutdown", close_client)
 sdk = CopilotKitRemoteEndpoint(
     agents=[
         CrewAIAgent(
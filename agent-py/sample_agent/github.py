@@ -0,0 +1,586 @@
+"""
+GitHub API helpers for the DevRel publisher agent.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, AsyncIterator, List, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import httpx
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+def _default_headers() -> Dict[str, str]:
+    """Build the headers sent with every GitHub API request."""
+    headers = {
+        "Accept": "application/vnd.github.v3+json",
+    }
+    github_token = os.getenv("GITHUB_TOKEN")
+    if github_token:
+        headers["Authorization"] = f"token {github_token}"
+    return headers
+
+# One pooled client per event loop, shared by every request and flow on it,
+# so connections to the API are reused. A client cannot be used from another
+# loop, so each loop (e.g. each asyncio.run) gets its own client, dropped
+# along with the loop.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+def _get_client() -> httpx.AsyncClient:
+    """Return the running loop's client, creating it on first use or after it was closed."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url="https://api.github.com",
+            headers=_default_headers(),
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20),
+            timeout=30,
+        )
+        _clients[loop] = client
+    return client
+
+async def close_client():
+    """
+    Close the running loop's client when the loop shuts down.
+
+    Flows on the same loop share the client, so this belongs in process or
+    server shutdown, not in a flow step.
+    """
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+# Cap on concurrent requests, to stay under GitHub's secondary rate limits
+MAX_CONCURRENT_REQUESTS = 8
+MAX_RETRIES = 5
+
+# Conditional-request cache: one file per "endpoint?params", holding the
+# ETag, parsed body and last page number. A 304 reply costs no rate limit,
+# so unchanged endpoints are served from here.
+CACHE_DIR = os.path.expanduser(os.getenv("DEVREL_CACHE_DIR", "~/.cache/devrel_agent"))
+ETAG_CACHE_DIR = os.path.join(CACHE_DIR, "github")
+# Entries younger than this are served without asking GitHub at all, which
+# also covers responses that carry no ETag
+GITHUB_CACHE_TTL = int(os.getenv("DEVREL_GITHUB_CACHE_TTL", 600))
+
+def _etag_cache_path(cache_key: str) -> str:
+    """Path of the cache file for a request, named by a short hash of it."""
+    digest = hashlib.blake2b(cache_key.encode(), digest_size=16).hexdigest()
+    return os.path.join(ETAG_CACHE_DIR, f"{digest}.json")
+
+def _load_etag_entry(cache_key: str) -> Optional[Tuple[str, Any, int]]:
+    """Read the cached (ETag, body, last page) for a request, if there is one."""
+    try:
+        with open(_etag_cache_path(cache_key)) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return tuple(entry) if len(entry) == 3 else None
+
+def _etag_entry_is_fresh(cache_key: str) -> bool:
+    """Whether the cache entry for a request was written within GITHUB_CACHE_TTL."""
+    try:
+        return time.time() - os.path.getmtime(_etag_cache_path(cache_key)) < GITHUB_CACHE_TTL
+    except OSError:
+        return False
+
+def _save_etag_entry(cache_key: str, entry: Tuple[Optional[str], Any, int]):
+    """Persist a cache entry so later runs can send conditional requests."""
+    try:
+        os.makedirs(ETAG_CACHE_DIR, exist_ok=True)
+        path = _etag_cache_path(cache_key)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(entry, f)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        print(f"Could not save GitHub ETag cache entry: {str(e)}")
+
+# Owner and repo name, without a trailing ".git", path, query or fragment;
+# ".git" only counts at the end of the name, so "foo.github.io" is kept whole
+_GH_URL_RE = re.compile(r"github\.com/([^/]+)/([^/?#]+?)(?:\.git)?(?:[/?#]|$)")
+
+@lru_cache(maxsize=1024)
+def extract_repo_info(repo_url: str) -> tuple:
+    """Extract owner and repo name from GitHub URL."""
+    match = _GH_URL_RE.search(repo_url)
+    if match:
+        return match.group(1), match.group(2)
+    raise ValueError(f"Invalid GitHub URL: {repo_url}")
+
+# Gateway errors GitHub returns while it is briefly overloaded
+_TRANSIENT_STATUSES = frozenset({502, 503, 504})
+# Longest rate-limit wait worth sleeping through; a limit that resets later
+# fails the request instead of stalling the flow
+MAX_RATE_LIMIT_WAIT = 60
+
+def _retry_delay(response: httpx.Response, attempt: int) -> Optional[float]:
+    """Seconds to wait before retrying a rate-limited or transient error, or None if it should not be retried."""
+    if response.status_code in _TRANSIENT_STATUSES:
+        return 0.5 * 2 ** attempt + random.uniform(0, 0.5)
+    if response.status_code not in (403, 429):
+        return None
+    jitter = random.uniform(0, 1)
+    retry_after = response.headers.get("Retry-After")
+    reset = response.headers.get("X-RateLimit-Reset")
+    if retry_after:
+        wait = float(retry_after)
+    elif response.headers.get("X-RateLimit-Remaining") == "0" and reset:
+        # Primary rate limit: no request succeeds until the window resets
+        wait = max(int(reset) - time.time(), 0)
+    elif response.status_code == 429 or response.headers.get("X-RateLimit-Remaining") == "0":
+        wait = 2 ** attempt
+    else:
+        # A plain 403 is a permissions error, not a rate limit
+        return None
+    if wait > MAX_RATE_LIMIT_WAIT:
+        return None
+    return wait + jitter
+
+def _last_page(response: httpx.Response) -> int:
+    """Read the number of the last page from the Link header of a list response."""
+    last_url = response.links.get("last", {}).get("url")
+    if not last_url:
+        return 1
+    return int(parse_qs(urlparse(last_url).query)["page"][0])
+
+async def _gather_bounded(coroutines) -> List[Any]:
+    """Await coroutines concurrently, at most MAX_CONCURRENT_REQUESTS at a time."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(run(c) for c in coroutines))
+
+async def _github_get(endpoint: str, params: Dict = None) -> Tuple[Any, int]:
+    """Fetch an endpoint, returning its parsed body and the number of its last page."""
+    # Lists default to 30 items a page; ask for the maximum
+    params = {"per_page": 100, **(params or {})}
+    # Sorted so the same request maps to one entry whatever the argument order
+    cache_key = f"{endpoint}?{urlencode(sorted(params.items()))}"
+    cached = _load_etag_entry(cache_key)
+    if cached and _etag_entry_is_fresh(cache_key):
+        return cached[1], cached[2]
+    headers = {}
+    if cached and cached[0]:
+        headers["If-None-Match"] = cached[0]
+
+    for attempt in range(MAX_RETRIES + 1):
+        response = await _get_client().get(f"/{endpoint}", params=params, headers=headers)
+        delay = _retry_delay(response, attempt)
+        if delay is None or attempt == MAX_RETRIES:
+            break
+        await asyncio.sleep(delay)
+
+    if response.status_code == 304:
+        return cached[1], cached[2]
+
+    if response.status_code != 200:
+        raise Exception(f"GitHub API error: {response.status_code} - {response.text}")
+
+    body = response.json()
+    last_page = _last_page(response)
+    _save_etag_entry(cache_key, (response.headers.get("ETag"), body, last_page))
+    return body, last_page
+
+async def github_api_request(endpoint: str, params: Dict = None) -> Dict:
+    """Make a request to GitHub API with proper auth and error handling."""
+    body, _ = await _github_get(endpoint, params)
+    return body
+
+async def github_api_paginate(endpoint: str, params: Dict = None) -> List[Dict]:
+    """
+    Fetch every page of a list endpoint.
+
+    The first page reveals the page count, then the rest are fetched concurrently.
+    """
+    first_page, last_page = await _github_get(endpoint, params)
+    if last_page <= 1:
+        return first_page
+    pages = await _gather_bounded(
+        github_api_request(endpoint, {**(params or {}), "page": page})
+        for page in range(2, last_page + 1)
+    )
+    return [item for page in [first_page, *pages] for item in page]
+
+async def iter_recent_pull_requests(owner: str, repo: str, since_iso: str) -> AsyncIterator[Dict]:
+    """
+    Yield pull requests created at or after an ISO-8601 timestamp, newest first.
+
+    Pages are fetched one at a time and paging stops at the first older pull
+    request, so a recent start date costs a page or two however long the
+    history is.
+    """
+    endpoint = f"repos/{owner}/{repo}/pulls"
+    params = {"state": "all", "sort": "created", "direction": "desc"}
+    page = 1
+    while True:
+        prs, last_page = await _github_get(endpoint, {**params, "page": page})
+        for pr in prs:
+            # ISO-8601 UTC timestamps order the same as strings
+            if pr["created_at"] < since_iso:
+                return
+            yield pr
+        if page >= last_page:
+            return
+        page += 1
+
+async def fetch_recent_pull_requests(owner: str, repo: str, since_iso: str) -> List[Dict]:
+    """Collect the pull requests created at or after an ISO-8601 timestamp."""
+    return [pr async for pr in iter_recent_pull_requests(owner, repo, since_iso)]
+
+def graphql_available() -> bool:
+    """
+    Whether GraphQL queries can be made. GitHub's GraphQL API rejects
+    unauthenticated requests, so without GITHUB_TOKEN callers use REST.
+    """
+    return bool(os.getenv("GITHUB_TOKEN"))
+
+async def github_graphql(query: str, variables: Dict = None) -> Dict:
+    """Run a query against the GitHub GraphQL API and return its data."""
+    for attempt in range(MAX_RETRIES + 1):
+        response = await _get_client().post(
+            "/graphql",
+            json={"query": query, "variables": variables or {}}
+        )
+        delay = _retry_delay(response, attempt)
+        if delay is None or attempt == MAX_RETRIES:
+            break
+        await asyncio.sleep(delay)
+
+    if response.status_code != 200:
+        raise Exception(f"GitHub GraphQL error: {response.status_code} - {response.text}")
+
+    body = response.json()
+    if body.get("errors"):
+        raise Exception(f"GitHub GraphQL error: {body['errors']}")
+
+    return body["data"]
+
+# Commits never change once pushed, so fetched details are kept for the life
+# of the process, evicting the least recently used past the limit
+COMMIT_DETAILS_CACHE_SIZE = 4096
+_commit_details: "OrderedDict[Tuple[str, str, str], Dict]" = OrderedDict()
+
+async def fetch_commit_details(owner: str, repo: str, shas: List[str]) -> List[Dict]:
+    """Fetch full commit objects concurrently, a few requests at a time."""
+    keys = [(owner, repo, sha) for sha in shas]
+    missing = list(dict.fromkeys(key for key in keys if key not in _commit_details))
+    fetched = await _gather_bounded(
+        github_api_request(f"repos/{owner}/{repo}/commits/{sha}") for _, _, sha in missing
+    )
+    _commit_details.update(zip(missing, fetched))
+    details = []
+    for key in keys:
+        _commit_details.move_to_end(key)
+        details.append(_commit_details[key])
+    while len(_commit_details) > COMMIT_DETAILS_CACHE_SIZE:
+        _commit_details.popitem(last=False)
+    return details
+
+# Pull requests looked up per GraphQL query, each under its own alias
+PR_FILES_BATCH_SIZE = 50
+
+def _pull_request_files_query(numbers: List[int]) -> str:
+    """Build one GraphQL query that fetches the files of each pull request as alias pr<number>."""
+    fields = "".join(
+        f" pr{int(number)}: pullRequest(number: {int(number)}) {{ files(first: 100) {{ nodes {{ path }} }} }}"
+        for number in numbers
+    )
+    return f"query($owner: String!, $name: String!) {{ repository(owner: $owner, name: $name) {{{fields} }} }}"
+
+async def fetch_pull_request_files(owner: str, repo: str, numbers: List[int]) -> List[List[str]]:
+    """
+    Fetch the changed file paths of several pull requests.
+
+    Pull requests are aliased into batched GraphQL queries, so a batch costs
+    one request instead of one per pull request. Without a token, each pull
+    request's first page of files comes from REST instead.
+    """
+    if not graphql_available():
+        pages = await _gather_bounded(
+            github_api_request(f"repos/{owner}/{repo}/pulls/{number}/files") for number in numbers
+        )
+        return [[f["filename"] for f in page] for page in pages]
+
+    batches = [numbers[i:i + PR_FILES_BATCH_SIZE] for i in range(0, len(numbers), PR_FILES_BATCH_SIZE)]
+    results = await _gather_bounded(
+        github_graphql(_pull_request_files_query(batch), {"owner": owner, "name": repo})
+        for batch in batches
+    )
+    files = {}
+    for data in results:
+        for alias, pr in data["repository"].items():
+            files[alias] = [f["path"] for f in pr["files"]["nodes"]] if pr else []
+    return [files[f"pr{number}"] for number in numbers]
+
+# Documentation is anything under these directories or one of these files
+# at the repository root. The same paths filter commit history server-side
+# (which takes plain paths, not patterns), so is_doc_file and the prefilter
+# in fetch_doc_commit_shas always agree
+DOC_DIRS = ("docs", "doc")
+DOC_FILES = ("README.md", "README.rst", "README", "CHANGELOG.md", "CHANGELOG.rst", "CHANGELOG")
+DOC_PATHS = DOC_DIRS + DOC_FILES
+
+_DOC_RE = re.compile(
+    "(?:{})/|(?:{})$".format(
+        "|".join(map(re.escape, DOC_DIRS)), "|".join(map(re.escape, DOC_FILES))
+    )
+)
+
+def is_doc_file(path: str) -> bool:
+    """Whether a changed file is documentation, i.e. falls under DOC_PATHS."""
+    return _DOC_RE.match(path) is not None
+
+def _doc_history_query(cursors: Dict[int, Optional[str]]) -> str:
+    """
+    Build one GraphQL query with the default branch history of each doc path
+    under alias path<index>, resuming each from its cursor.
+    """
+    fields = "".join(
+        f" path{i}: history(first: 100, since: $since, path: {json.dumps(DOC_PATHS[i])}"
+        + (f", after: {json.dumps(cursor)}" if cursor else "")
+        + ") { pageInfo { hasNextPage endCursor } nodes { oid } }"
+        for i, cursor in cursors.items()
+    )
+    return (
+        "query($owner: String!, $name: String!, $since: GitTimestamp!) {"
+        " repository(owner: $owner, name: $name) { defaultBranchRef { target { ... on Commit {"
+        f"{fields} }} }} }} }}"
+    )
+
+async def fetch_doc_commit_shas(owner: str, repo: str, since: str) -> set:
+    """
+    Collect the SHAs of commits since a date that touch a documentation path.
+
+    Every path's history is requested in one aliased GraphQL query; only
+    paths with more pages are queried again. Without a token, each path's
+    commits are listed over REST instead.
+    """
+    if not graphql_available():
+        since_iso = f"{since}T00:00:00Z"
+        path_commits = await asyncio.gather(*(
+            github_api_paginate(f"repos/{owner}/{repo}/commits", {"path": path, "since": since_iso})
+            for path in DOC_PATHS
+        ))
+        return {commit["sha"] for commits in path_commits for commit in commits}
+
+    variables = {"owner": owner, "name": repo, "since": f"{since}T00:00:00Z"}
+    cursors = {i: None for i in range(len(DOC_PATHS))}
+    shas = set()
+    while cursors:
+        data = await github_graphql(_doc_history_query(cursors), variables)
+        target = data["repository"]["defaultBranchRef"]["target"]
+        next_cursors = {}
+        for i in cursors:
+            history = target[f"path{i}"]
+            shas.update(node["oid"] for node in history["nodes"])
+            if history["pageInfo"]["hasNextPage"]:
+                next_cursors[i] = history["pageInfo"]["endCursor"]
+        cursors = next_cursors
+    return shas
+
+# Pull request files stand in for commit files: the Commit object in GraphQL
+# does not expose its diff, but a commit that merged a PR (squash or merge
+# commit) changed exactly the PR's files. Commits on a PR branch are also
+# associated with it, so the PR is only trusted when it merged as this commit.
+COMMIT_FILES_QUERY = """
+query($owner: String!, $name: String!, $since: GitTimestamp!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    defaultBranchRef {
+      target {
+        ... on Commit {
+          history(first: 100, since: $since, after: $cursor) {
+            pageInfo { hasNextPage endCursor }
+            nodes {
+              oid
+              associatedPullRequests(first: 1) {
+                nodes { mergeCommit { oid } files(first: 100) { nodes { path } } }
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+async def fetch_commit_files(owner: str, repo: str, since: str) -> Dict[str, List[str]]:
+    """
+    Map commit SHAs on the default branch since a date to their changed files.
+
+    Commits that did not merge a pull request are left out of the result, as
+    is everything when there is no token for GraphQL; callers fetch those
+    commits' details instead.
+    """
+    commit_files = {}
+    if not graphql_available():
+        return commit_files
+    cursor = None
+    while True:
+        data = await github_graphql(COMMIT_FILES_QUERY, {
+            "owner": owner,
+            "name": repo,
+            "since": f"{since}T00:00:00Z",
+            "cursor": cursor
+        })
+        history = data["repository"]["defaultBranchRef"]["target"]["history"]
+        for node in history["nodes"]:
+            prs = node["associatedPullRequests"]["nodes"]
+            if prs and (prs[0]["mergeCommit"] or {}).get("oid") == node["oid"]:
+                commit_files[node["oid"]] = [f["path"] for f in prs[0]["files"]["nodes"]]
+        if not history["pageInfo"]["hasNextPage"]:
+            return commit_files
+        cursor = history["pageInfo"]["endCursor"]
+
+# First page of each kind of activity, with only the fields the prompts use;
+# the kinds a tool call did not ask for are skipped with @include
+REPOSITORY_DATA_QUERY = """
+query(
+  $owner: String!, $name: String!, $since: GitTimestamp!, $issuesSince: DateTime!,
+  $commits: Boolean!, $issues: Boolean!, $pullRequests: Boolean!
+) {
+  repository(owner: $owner, name: $name) {
+    defaultBranchRef @include(if: $commits) {
+      target {
+        ... on Commit {
+          history(first: 100, since: $since) {
+            nodes { oid message authoredDate }
+          }
+        }
+      }
+    }
+    issues(first: 100, filterBy: {since: $issuesSince}, orderBy: {field: CREATED_AT, direction: DESC})
+      @include(if: $issues) {
+      nodes { number title state createdAt }
+    }
+    pullRequests(first: 100, orderBy: {field: CREATED_AT, direction: DESC})
+      @include(if: $pullRequests) {
+      nodes { number title state createdAt }
+    }
+  }
+}
+"""
+
+def _project_graphql_issue(node: Dict) -> Dict:
+    """Shape a GraphQL issue or pull request node like project_issue's output."""
+    return {
+        "number": node["number"],
+        "title": node["title"],
+        # REST reports merged pull requests as closed
+        "state": "closed" if node["state"] == "MERGED" else node["state"].lower(),
+        "created_at": node["createdAt"]
+    }
+
+async def _fetch_repository_data_rest(owner: str, repo: str, since: str, selected: Dict[str, bool]) -> Dict[str, Any]:
+    """REST version of fetch_repository_data, for use without a token."""
+    fetches = {}
+    if selected["commits"]:
+        fetches["commits"] = github_api_request(f"repos/{owner}/{repo}/commits", {"since": since})
+    if selected["issues"]:
+        fetches["issues"] = github_api_request(f"repos/{owner}/{repo}/issues", {"state": "all", "since": since})
+    if selected["pull_requests"]:
+        fetches["pull_requests"] = github_api_request(
+            f"repos/{owner}/{repo}/pulls", {"state": "all", "sort": "created", "direction": "desc"}
+        )
+    results = dict(zip(fetches, await asyncio.gather(*fetches.values())))
+
+    if "commits" in results:
+        results["commits"] = [project_commit(c) for c in results["commits"]]
+    if "issues" in results:
+        # The REST issue list includes pull requests; GraphQL's does not
+        results["issues"] = [project_issue(i) for i in results["issues"] if "pull_request" not in i]
+    if "pull_requests" in results:
+        results["pull_requests"] = [project_issue(pr) for pr in results["pull_requests"]]
+    return results
+
+async def fetch_repository_data(owner: str, repo: str, start_date: str, data_type: str) -> Dict[str, Any]:
+    """
+    Fetch the first page of commits, issues and/or pull requests for a tool call.
+
+    `data_type` selects one kind or "all". Every selected kind comes from a
+    single GraphQL request, already projected like project_commit and
+    project_issue. Without a token, the selected lists are fetched
+    concurrently over REST and projected the same way.
+    """
+    since = f"{start_date}T00:00:00Z"
+    selected = {
+        kind: data_type in (kind, "all")
+        for kind in ("commits", "issues", "pull_requests")
+    }
+    if not any(selected.values()):
+        return {}
+    if not graphql_available():
+        return await _fetch_repository_data_rest(owner, repo, since, selected)
+    data = await github_graphql(REPOSITORY_DATA_QUERY, {
+        "owner": owner,
+        "name": repo,
+        "since": since,
+        "issuesSince": since,
+        "commits": selected["commits"],
+        "issues": selected["issues"],
+        "pullRequests": selected["pull_requests"]
+    })
+    repository = data["repository"]
+
+    result = {}
+    if selected["commits"]:
+        history = repository["defaultBranchRef"]["target"]["history"]["nodes"]
+        result["commits"] = [{
+            "sha": commit["oid"],
+            "message": commit["message"],
+            "date": commit["authoredDate"]
+        } for commit in history]
+    if selected["issues"]:
+        result["issues"] = [_project_graphql_issue(i) for i in repository["issues"]["nodes"]]
+    if selected["pull_requests"]:
+        result["pull_requests"] = [_project_graphql_issue(pr) for pr in repository["pullRequests"]["nodes"]]
+    return result
+
+# Projections of REST payloads, which carry far more than the prompts use
+def project_commit(commit: Dict) -> Dict:
+    """Keep only the commit fields the prompts use."""
+    return {
+        "sha": commit["sha"],
+        "message": commit["commit"]["message"],
+        "date": commit["commit"]["author"]["date"]
+    }
+
+def project_issue(issue: Dict) -> Dict:
+    """Keep only the issue or pull request fields the topic prompt uses."""
+    return {
+        "number": issue["number"],
+        "title": issue["title"],
+        "state": issue["state"],
+        "created_at": issue["created_at"]
+    }
+
+def issue_details(issue: Dict) -> Dict:
+    """Keep the issue or pull request fields needed to write about it."""
+    return {
+        **project_issue(issue),
+        "body": issue.get("body") or "",
+        "user": issue["user"]["login"]
+    }
+
+def parse_issue_number(source_id: Any) -> Optional[int]:
+    """Normalize an LLM-supplied source id such as "123" or "#123" to a number."""
+    try:
+        return int(str(source_id).strip().lstrip("#"))
+    except ValueError:
+        return None
@@ -0,0 +1,205 @@
+"""
+Helpers for building LLM requests for the DevRel publisher agent.
+"""
+
+import json
+import os
+import re
+from typing import Any, Awaitable, Callable, List, Dict, Optional, Sequence
+
+import orjson
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Picking topics is a routing step, so it runs on a fast, cheap model and
+# only drafting uses the full model
+TOPIC_MODEL = os.getenv("DEVREL_TOPIC_MODEL", "openai/gpt-4o-mini")
+CONTENT_MODEL = os.getenv("DEVREL_CONTENT_MODEL", "openai/gpt-4o")
+
+# Marks the end of a prompt prefix the provider may cache between calls
+EPHEMERAL_CACHE = {"type": "ephemeral"}
+
+def supports_cache_control(model: str) -> bool:
+    """
+    Whether the model needs explicit cache_control breakpoints.
+
+    Anthropic only caches marked prefixes. OpenAI caches stable prefixes
+    automatically, so its messages are left in the plain form.
+    """
+    return model.startswith("anthropic/") or "claude" in model
+
+def cacheable_message(role: str, text: str, model: str) -> Dict:
+    """Build a message that ends a cacheable prefix, marked where the provider needs it."""
+    if not supports_cache_control(model):
+        return {"role": role, "content": text}
+    return {
+        "role": role,
+        "content": [{"type": "text", "text": text, "cache_control": EPHEMERAL_CACHE}]
+    }
+
+def system_message(prompt: str, model: str) -> Dict:
+    """Build the system message, marking it cacheable where the provider needs it."""
+    return cacheable_message("system", prompt, model)
+
+def cacheable_tools(tools: List[Dict], model: str, extra_tools: Sequence[Dict] = ()) -> List[Dict]:
+    """
+    Mark the tool definitions as part of the cached prompt prefix.
+
+    The breakpoint goes on the last of ``tools``, which caches every tool
+    before it. ``extra_tools`` (e.g. frontend actions that vary per request)
+    follow the breakpoint so they do not invalidate the cached prefix.
+    """
+    if not tools or not supports_cache_control(model):
+        return [*tools, *extra_tools]
+    return [*tools[:-1], {**tools[-1], "cache_control": EPHEMERAL_CACHE}, *extra_tools]
+
+def _field(message: Any, key: str) -> Any:
+    """Read a field from a dict message or a LiteLLM message object."""
+    if isinstance(message, dict):
+        return message.get(key)
+    return getattr(message, key, None)
+
+def dumps(obj: Any) -> str:
+    """Serialize repository data for a prompt with orjson's C encoder."""
+    return orjson.dumps(obj).decode()
+
+def loads(text: str) -> Any:
+    """Parse JSON with orjson's C decoder."""
+    return orjson.loads(text)
+
+# Repository data sent to the topic model: at most this many items of each
+# kind, and within this many tokens overall
+CONTEXT_ITEMS_PER_SECTION = 10
+MAX_CONTEXT_TOKENS = 4000
+
+def compact_context(max_tokens: int = MAX_CONTEXT_TOKENS, **sections: List[Any]) -> str:
+    """
+    Serialize the first items of each section as one compact JSON object.
+
+    While the result is over the token budget, the last item of the longest
+    section is dropped.
+    """
+    context = {name: list(items[:CONTEXT_ITEMS_PER_SECTION]) for name, items in sections.items()}
+    serialized = dumps(context)
+    while len(serialized) // 4 > max_tokens and any(context.values()):
+        max(context.values(), key=len).pop()
+        serialized = dumps(context)
+    return serialized
+
+_decoder = json.JSONDecoder()
+
+def loads_tolerant(text: str) -> Optional[Any]:
+    """
+    Parse tool-call arguments, recovering the first JSON object from noisy output.
+
+    Returns None when no JSON object can be decoded.
+    """
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        # The stdlib decoder can stop at the end of the first object
+        start = text.find("{")
+        if start < 0:
+            return None
+        try:
+            return _decoder.raw_decode(text, start)[0]
+        except json.JSONDecodeError:
+            return None
+
+def has_tool_call(name: str) -> Callable[[Any], bool]:
+    """
+    Build a check that a message calls tool `name` with parseable arguments.
+
+    Used to keep completions that produced nothing usable out of the cache.
+    """
+    def check(message: Any) -> bool:
+        for tool_call in _field(message, "tool_calls") or []:
+            function = _field(tool_call, "function")
+            if _field(function, "name") == name and loads_tolerant(_field(function, "arguments") or "") is not None:
+                return True
+        return False
+    return check
+
+# Characters that can change nesting or string state; everything else is
+# skipped by the regex engine rather than by a Python loop
+_JSON_STRUCTURE_RE = re.compile(r'[{}"\\]')
+
+def extract_json_object(text: str) -> Optional[str]:
+    """
+    Return the first balanced {...} block in text, or None if there is none.
+
+    One pass tracks nesting depth, ignoring braces inside JSON strings, so
+    nested objects are kept whole.
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+    depth = 0
+    in_string = False
+    escaped_at = -1
+    for match in _JSON_STRUCTURE_RE.finditer(text, start):
+        char = match.group()
+        position = match.start()
+        if in_string:
+            if position == escaped_at:
+                continue
+            if char == "\\":
+                escaped_at = position + 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:position + 1]
+    return None
+
+async def stream_tool_calls(
+    response: Any,
+    on_tool_arguments: Optional[Callable[[str, Any], Awaitable[None]]] = None
+) -> Dict:
+    """
+    Consume a streamed completion and assemble the assistant message.
+
+    `on_tool_arguments(name, arguments)` is awaited for each tool call as soon
+    as its arguments form a complete JSON object, before the stream finishes.
+    """
+    content = []
+    tool_calls: Dict[int, Dict] = {}
+    reported = set()
+    async for chunk in response:
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content.append(delta.content)
+        for tool_call_delta in delta.tool_calls or []:
+            tool_call = tool_calls.setdefault(tool_call_delta.index, {
+                "id": None,
+                "type": "function",
+                "function": {"name": "", "arguments": ""}
+            })
+            if tool_call_delta.id:
+                tool_call["id"] = tool_call_delta.id
+            function = tool_call_delta.function
+            if function.name:
+                tool_call["function"]["name"] += function.name
+            if not function.arguments:
+                continue
+            tool_call["function"]["arguments"] += function.arguments
+            # Only a closing brace can complete the object, so skip parsing otherwise
+            if on_tool_arguments and tool_call_delta.index not in reported and "}" in function.arguments:
+                try:
+                    arguments = orjson.loads(tool_call["function"]["arguments"])
+                except orjson.JSONDecodeError:
+                    continue
+                reported.add(tool_call_delta.index)
+                await on_tool_arguments(tool_call["function"]["name"], arguments)
+
+    message = {"role": "assistant", "content": "".join(content) or None}
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)]
+    return message
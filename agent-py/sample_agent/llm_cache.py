@@ -0,0 +1,232 @@
+"""
+Response cache for deterministic LLM completions.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Protocol
+
+LLM_CACHE_DIR = os.path.join(
+    os.path.expanduser(os.getenv("DEVREL_CACHE_DIR", "~/.cache/devrel_agent")), "llm"
+)
+# Cached responses expire so drafts eventually pick up prompt or model changes
+LLM_CACHE_TTL = int(os.getenv("DEVREL_LLM_CACHE_TTL", 24 * 60 * 60))
+
+class CacheBackend(Protocol):
+    """Storage for cached assistant messages, keyed by request hash."""
+
+    def get(self, key: str) -> Optional[Dict]:
+        ...
+
+    def set(self, key: str, value: Dict) -> None:
+        ...
+
+class FileCacheBackend:
+    """Stores each cached message as a JSON file named after its key."""
+
+    def __init__(self, directory: str = LLM_CACHE_DIR, ttl: int = LLM_CACHE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[Dict]:
+        path = os.path.join(self.directory, f"{key}.json")
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key: str, value: Dict) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{key}.json")
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(value, f, default=str)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            print(f"Could not write LLM cache entry: {str(e)}")
+
+class RedisCacheBackend:
+    """Stores cached messages in Redis so several workers share them."""
+
+    def __init__(self, url: str, ttl: int = LLM_CACHE_TTL):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[Dict]:
+        raw = self._redis.get(f"devrel:llm:{key}")
+        return json.loads(raw) if raw else None
+
+    def set(self, key: str, value: Dict) -> None:
+        self._redis.set(f"devrel:llm:{key}", json.dumps(value, default=str), ex=self.ttl)
+
+def default_backend() -> CacheBackend:
+    """Use Redis when REDIS_URL is set and the client is installed, else local files."""
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        try:
+            return RedisCacheBackend(redis_url)
+        except ImportError:
+            print("REDIS_URL is set but redis is not installed, caching LLM responses on disk")
+    return FileCacheBackend()
+
+# Near-duplicate prompts are matched on embeddings; opt in with
+# DEVREL_SEMANTIC_CACHE once `python -m sample_agent.db` has created the table
+SEMANTIC_EMBEDDING_MODEL = os.getenv("DEVREL_EMBEDDING_MODEL", "openai/text-embedding-3-small")
+SEMANTIC_CACHE_MIN_SIMILARITY = 0.95
+
+class SemanticCache:
+    """
+    Finds cached responses to prompts nearly identical to a new one.
+
+    Prompts are embedded and matched by cosine similarity in Postgres with
+    pgvector, in the same database as the content table.
+    """
+
+    def __init__(
+        self,
+        embedding_model: str = SEMANTIC_EMBEDDING_MODEL,
+        min_similarity: float = SEMANTIC_CACHE_MIN_SIMILARITY
+    ):
+        self.embedding_model = embedding_model
+        self.min_similarity = min_similarity
+
+    async def embed(self, text: str) -> List[float]:
+        from litellm import aembedding
+        response = await aembedding(model=self.embedding_model, input=[text])
+        return response.data[0]["embedding"]
+
+    async def get(self, namespace: str, embedding: List[float]) -> Optional[Dict]:
+        from sample_agent.db import find_cached_response
+        return await asyncio.to_thread(find_cached_response, namespace, embedding, self.min_similarity)
+
+    async def set(self, namespace: str, embedding: List[float], value: Dict) -> None:
+        from sample_agent.db import insert_cached_response
+        await asyncio.to_thread(insert_cached_response, namespace, embedding, value)
+
+def default_semantic_cache() -> Optional[SemanticCache]:
+    """Use the semantic cache only when DEVREL_SEMANTIC_CACHE is set."""
+    return SemanticCache() if os.getenv("DEVREL_SEMANTIC_CACHE") else None
+
+def cache_key(model: str, messages: List[Dict], tools: Optional[List[Dict]]) -> str:
+    """Hash the parts of a completion request that determine its response."""
+    payload = json.dumps({
+        "model": model,
+        "messages": messages,
+        "tools": tools or []
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def semantic_namespace(model: str, tools: Optional[List[Dict]], scope: Optional[str] = None) -> str:
+    """
+    Group semantic cache entries by model, tool definitions and scope.
+
+    A prompt that resembles one made for different tools, such as a content
+    draft resembling a topic request, never matches it. Neither does one
+    with a different `scope`, such as a draft about another source.
+    """
+    payload = json.dumps({"tools": tools or [], "scope": scope}, sort_keys=True, default=str)
+    return f"{model}:{hashlib.sha256(payload.encode()).hexdigest()[:16]}"
+
+def _message_to_dict(message: Any) -> Dict:
+    """Convert a LiteLLM message into a JSON-serializable dict."""
+    if isinstance(message, dict):
+        return message
+    return message.model_dump()
+
+class LLMResponseCache:
+    """
+    Serves repeated deterministic completions from a cache backend.
+
+    Tracks hits and misses so the flow can report how effective it is.
+    """
+
+    def __init__(self, backend: Optional[CacheBackend] = None, semantic: Optional[SemanticCache] = None):
+        self.backend = backend or default_backend()
+        self.semantic = semantic or default_semantic_cache()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "semantic_hits": self.semantic_hits, "misses": self.misses}
+
+    async def complete(
+        self,
+        create: Callable[..., Awaitable[Any]],
+        *,
+        model: str,
+        messages: List[Dict],
+        tools: Optional[List[Dict]] = None,
+        temperature: Optional[float] = None,
+        semantic_key: Optional[str] = None,
+        semantic_scope: Optional[str] = None,
+        validate: Optional[Callable[[Any], bool]] = None,
+        **kwargs
+    ) -> Any:
+        """
+        Return the assistant message for a completion request.
+
+        `create` receives the completion arguments on a cache miss and must
+        return the assistant message. Hits return the cached message as a dict.
+        Sampled completions (a non-zero temperature) are never cached.
+
+        With a semantic cache configured, `semantic_key` is the part of the
+        prompt compared for near-duplicates when there is no exact hit, and
+        only against entries with the same `semantic_scope`.
+
+        A response is only cached when `validate(message)` is true, so an
+        unusable completion is retried rather than replayed. Cache failures
+        are logged and treated as misses.
+        """
+        request = {"model": model, "messages": messages, "tools": tools, **kwargs}
+        if temperature is not None:
+            request["temperature"] = temperature
+        if temperature not in (0, None):
+            return await create(**request)
+
+        key = cache_key(model, messages, tools)
+        try:
+            cached = self.backend.get(key)
+        except Exception as e:
+            print(f"LLM cache unavailable: {str(e)}")
+            cached = None
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        embedding = None
+        namespace = semantic_namespace(model, tools, semantic_scope)
+        if semantic_key and self.semantic:
+            try:
+                embedding = await self.semantic.embed(semantic_key)
+                cached = await self.semantic.get(namespace, embedding)
+            except Exception as e:
+                print(f"Semantic cache unavailable: {str(e)}")
+                embedding = cached = None
+            if cached is not None:
+                self.semantic_hits += 1
+                return cached
+
+        self.misses += 1
+        message = await create(**request)
+        if validate is not None and not validate(message):
+            return message
+        value = _message_to_dict(message)
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            print(f"Could not write LLM cache entry: {str(e)}")
+        if embedding is not None:
+            try:
+                await self.semantic.set(namespace, embedding, value)
+            except Exception as e:
+                print(f"Could not write semantic cache entry: {str(e)}")
+        return message
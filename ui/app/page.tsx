@@ -45,8 +45,14 @@ type ContentRecord = {
   id?: string;
 };
 
+type Progress = {
+  stage: string;
+  count: number;
+};
+
 type AgentState = {
   content_record?: ContentRecord;
+  progress?: Progress;
   status?: string;
   error?: string;
 };
@@ -60,6 +66,11 @@ function YourMainContent({ themeColor }: { themeColor: string }) {
         {state?.status && (
           <div className="mb-2 text-blue-600 font-semibold">{state.status}</div>
         )}
+        {state?.progress && !state?.content_record && (
+          <div className="mb-2 text-sm text-gray-500">
+            {state.progress.stage.replace(/_/g, " ")}: {state.progress.count}
+          </div>
+        )}
         {state?.error && (
           <div className="mb-2 text-red-600 font-semibold">{state.error}</div>
         )}